@@ -1,3 +1,4 @@
+import pandas as pd
 import streamlit as st
 
 # import utils app components
@@ -10,6 +11,10 @@ from frontend.homepage import homepage
 from frontend.results_page import results_page
 from frontend.upload_page import upload_file_page
 
+# Copy-on-Write for the whole app, set once at startup: derived frames share
+# their parent's column blocks until written to, so no defensive deep copies
+pd.set_option("mode.copy_on_write", True)
+
 
 def main():
     configure_page()
@@ -73,3 +73,8 @@ UI_CONFIG = config.get("ui", {})
 PAGE_TITLE = UI_CONFIG.get("page_title", "SAIL - Skills Proficiency Tagging Portal")
 PAGE_ICON = UI_CONFIG.get("page_icon", "../public/assets/images/sail_logo.png")
 APP_NAME_DISPLAY = UI_CONFIG.get("app_name_display", "SAIL")
+
+# === LLM Request Pacing ===
+LLM_CONFIG = config.get("llm", {})
+LLM_REQUESTS_PER_MINUTE = LLM_CONFIG.get("requests_per_minute", 300)
+LLM_MAX_WORKERS = LLM_CONFIG.get("max_workers", 32)
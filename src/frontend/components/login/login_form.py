@@ -10,14 +10,19 @@ def login_form(disabled: bool = False):
     """Render the login form with email and password inputs"""
     # email = st.text_input("E-mail", placeholder="Enter your SSG email address")
     email = "Test user"
-    password = st.text_input(
-        "Password",
-        placeholder="Enter your copied password",
-        type="password",
-        disabled=disabled,
-    )
+    # A form only reruns the script on submit, not on every keystroke
+    with st.form("login_form", clear_on_submit=False, border=False):
+        password = st.text_input(
+            "Password",
+            placeholder="Enter your copied password",
+            type="password",
+            disabled=disabled,
+        )
+        submitted = st.form_submit_button(
+            "Login", use_container_width=True, disabled=disabled
+        )
 
-    if st.button("Login", use_container_width=True, disabled=disabled):
+    if submitted:
         if not (password):
             st.error("You must have a password to Log in!")
         elif authenticate_user(email, password):
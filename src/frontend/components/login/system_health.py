@@ -3,11 +3,11 @@ from utils.health_check import check_openai_api_health, check_s3_health
 from config import USE_S3
 
 
-def check_all_systems_health():
-    """
-    Performs health checks for all critical systems.
-    Returns a tuple: (all_systems_healthy, openai_healthy, s3_healthy)
-    """
+class _UnhealthySystems(Exception):
+    """Raised from the cached probe so a failed result is never cached."""
+
+
+def _probe_all_systems():
     if USE_S3:
         openai_healthy = check_openai_api_health()
         s3_healthy = check_s3_health()
@@ -19,6 +19,28 @@ def check_all_systems_health():
     return all_healthy, openai_healthy, s3_healthy
 
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_healthy_probe():
+    # st.cache_data does not cache exceptions, so only healthy results stick
+    health = _probe_all_systems()
+    if not health[0]:
+        raise _UnhealthySystems(health)
+    return health
+
+
+def check_all_systems_health():
+    """
+    Performs health checks for all critical systems.
+    Healthy results are cached for a minute so reruns of the login page don't
+    re-probe; a failed probe is not cached, so the next rerun checks again.
+    Returns a tuple: (all_systems_healthy, openai_healthy, s3_healthy)
+    """
+    try:
+        return _cached_healthy_probe()
+    except _UnhealthySystems as e:
+        return e.args[0]
+
+
 def display_system_health(openai_healthy: bool, s3_healthy: bool):
     """Displays the system health status for OpenAI and S3 clients."""
     openai_status = "🟢 Healthy" if openai_healthy else "🔴 Unhealthy"
@@ -4,16 +4,23 @@ from config import PROCESS_CHOICES
 from utils.upload_utils import get_process_alias, get_process
 
 
+def _on_process_change():
+    # Parse out the alias and display name only when the selection changes
+    selected_process = st.session_state.process_choice
+    st.session_state.selected_process_alias = get_process_alias(selected_process)
+    st.session_state.selected_process = get_process(selected_process)
+
+
 def sector_selector():
     st.markdown("<h3>Select a Sector:</h3>", unsafe_allow_html=True)
-    selected_process = st.selectbox(
+    # A fresh widget (first render, or after navigating back) needs one sync
+    needs_sync = "process_choice" not in st.session_state
+    st.selectbox(
         "Select a process:",
         PROCESS_CHOICES,
         key="process_choice",
+        on_change=_on_process_change,
         help="Pick which pipeline you want to run.",
     )
-    # Parse out the alias and display name
-    alias = get_process_alias(selected_process)
-    display = get_process(selected_process)
-    st.session_state.selected_process_alias = alias
-    st.session_state.selected_process = display
+    if needs_sync:
+        _on_process_change()
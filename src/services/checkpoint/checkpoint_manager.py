@@ -1,17 +1,27 @@
+import hashlib
+import pickle
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 from config import CHECKPOINT_PATH
 from services.storage import *
+from services.llm_pipeline.completion_cache import completion_cache
 
 
 class CheckpointManager:
     """
     Manages saving and loading of pipeline state to a pickle file.
     Abstracts I/O for easy migration to S3 or local.
+
+    The growing r1/r2 result lists are not rewritten on every save: each save
+    appends only the new results as a `.part` file and the .pkl records the
+    list of parts, so a save costs O(new results) rather than O(all results).
     """
 
+    RESULT_KEYS = ("r1_results", "r2_results")
+
     def __init__(self, alias: str, TIMESTAMP: str, checkpoint_dir=None):
         if checkpoint_dir is None:
             # Default to config path (can be S3 or local)
@@ -19,17 +29,52 @@ class CheckpointManager:
         self.base_checkpoint_path = str(checkpoint_dir)
         filename = f"{alias}_checkpoint_{TIMESTAMP}.pkl"
         self.checkpoint_path = f"{self.base_checkpoint_path}/{filename}"
+        # Not a .pkl, so it never shows up as a checkpoint candidate
+        self.completion_cache_path = (
+            f"{self.base_checkpoint_path}/llm_completion_cache.cache"
+        )
+        # Names the latest checkpoint so load() needs no directory listing
+        self.latest_pointer_path = f"{self.base_checkpoint_path}/LATEST.ptr"
+        self._pointer_target = None
         self.state = {}
+        # Saves run on one background thread so callers don't wait on S3
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending_save = None
+        self._last_written = None
         self.last_progress = 0
         self.current_round = None
+        self.alias = alias
         self.sector = alias
 
-    def load(self) -> bool:
-        """Load the most recent checkpoint (.pkl) from local or S3."""
-        # List all .pkl files
+    def _read_latest_pointer(self):
+        """Checkpoint path named by the LATEST pointer, or None if there is none."""
+        try:
+            latest_file = load_pickle(self.latest_pointer_path)
+        except Exception:
+            return None
+        return latest_file if isinstance(latest_file, str) else None
+
+    def _known_checkpoint_paths(self):
+        """
+        Checkpoint paths to try before listing: the one this session last loaded
+        for the alias (no request at all), then the LATEST pointer (one GET).
+        """
+        session_path = st.session_state.get("latest_ckpt_path", {}).get(self.alias)
+        if session_path is not None:
+            yield session_path
+        pointer_path = self._read_latest_pointer()
+        if pointer_path is not None and pointer_path != session_path:
+            yield pointer_path
+
+    def _remember_path(self, path):
+        """Record `path` as this session's latest checkpoint for the alias."""
+        st.session_state.setdefault("latest_ckpt_path", {})[self.alias] = path
+
+    def _find_latest_checkpoint(self):
+        """Most recent checkpoint (.pkl) by listing the checkpoint directory."""
         pkl_files = list_files(self.base_checkpoint_path, "*.pkl")
         if not pkl_files:
-            return False
+            return None
 
         # Find most recently modified (for S3, you might want to sort by filename or implement S3 last-modified)
         # Here, we assume lexicographical order if S3, timestamped filename
@@ -39,20 +84,82 @@ class CheckpointManager:
         else:
             # S3: use the latest by filename (relies on TIMESTAMP in name)
             latest_file = sorted(pkl_files)[-1]
-        self.checkpoint_path = latest_file
+        return latest_file
+
+    def _join_result_parts(self, state):
+        """Rebuild each result list from the .part files recorded in `state`."""
+        for key, parts in state.get("result_parts", {}).items():
+            results = []
+            # Parts are independent objects: fetch them concurrently, keep order
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for chunk in pool.map(load_pickle, parts["paths"]):
+                    results.extend(chunk)
+            state[key] = results
+        return state
 
-        with st.spinner("Retrieving data from previously saved checkpoint"):
-            self.state = load_pickle(latest_file)
+    def _write_result_parts(self, state):
+        """
+        Append results added since the last save as new .part files and return
+        the state to pickle, with the result lists replaced by the part index.
+        """
+        parts_index = state["result_parts"]
+        to_pickle = dict(state)
+        for key in self.RESULT_KEYS:
+            results = state.get(key)
+            if results is None:
+                continue
+            parts = parts_index.get(key)
+            if parts is None or parts["count"] > len(results):
+                # New round (or a reset list): start a fresh chain of parts
+                parts = parts_index[key] = {"paths": [], "count": 0}
+            new = results[parts["count"] :]
+            if new:
+                stem = self.checkpoint_path[: -len(".pkl")]
+                part_path = f"{stem}_{key}_{len(parts['paths']):05d}.part"
+                save_pickle(new, part_path)
+                parts["paths"].append(part_path)
+                parts["count"] = len(results)
+            to_pickle[key] = []
+        return to_pickle
+
+    def load(self) -> bool:
+        """Load the most recent checkpoint (.pkl) from local or S3."""
+        self.flush()
+        state = None
+        for latest_file in self._known_checkpoint_paths():
+            try:
+                with st.spinner("Retrieving data from previously saved checkpoint"):
+                    state = load_pickle(latest_file)
+                break
+            except Exception as e:
+                # A stale path (checkpoint removed): try the next, then list
+                print(f"[Checkpoint] Known path {latest_file} unusable: {e}")
+
+        if state is None:
+            latest_file = self._find_latest_checkpoint()
+            if latest_file is None:
+                return False
+            with st.spinner("Retrieving data from previously saved checkpoint"):
+                state = load_pickle(latest_file)
+
+        self.checkpoint_path = latest_file
+        self._pointer_target = latest_file
+        self._remember_path(latest_file)
+        self.state = self._join_result_parts(state)
 
         print(f"[Checkpoint] Loaded state from {latest_file}")
+        completion_cache.restore(self.completion_cache_path)
         self.last_progress = self.state.get("progress", self.last_progress)
         self.current_round = self.state.get("round", self.current_round)
         self.sector = self.state.get("sector", self.sector)
         st.session_state.selected_process_alias = self.sector
         return True
 
-    def save(self):
-        """Save checkpoint (to local or S3 as a .pkl)."""
+    def save(self, wait: bool = False):
+        """
+        Save checkpoint (to local or S3 as a .pkl) in the background.
+        Pass wait=True to block until it is written.
+        """
         # Calculate and store progress information
         if "r1_pending" in self.state and "r1_results" in self.state:
             total = len(self.state["r1_pending"]) + len(self.state["r1_results"])
@@ -66,8 +173,64 @@ class CheckpointManager:
                 self.state["progress"] = self.last_progress
 
         self.state["sector"] = st.session_state.selected_process_alias
+        # Created here, not in the writer, so it lives on across state snapshots
+        self.state.setdefault("result_parts", {})
 
-        save_pickle(self.state, self.checkpoint_path)
-        print(f"[Checkpoint] Saved state at {datetime.now()}")
+        # Snapshot the lists: the resume loops keep appending while we write
+        snapshot = {
+            k: list(v) if isinstance(v, list) else v for k, v in self.state.items()
+        }
+        # At most one save in flight; its errors surface here
+        self.flush()
+        self._pending_save = self._writer.submit(
+            self._write, snapshot, self.checkpoint_path
+        )
+        # Reported as soon as it fails, even if nothing flushes it afterwards
+        self._pending_save.add_done_callback(self._report_failed_save)
+        if wait:
+            self.flush()
 
         st.session_state.pkl_yes = True
+        self._remember_path(self.checkpoint_path)
+
+    def _write(self, snapshot, checkpoint_path):
+        meta = self._write_result_parts(snapshot)
+        # The .pkl is small now; skip the upload if it is byte-identical
+        digest = hashlib.blake2b(
+            pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16
+        ).digest()
+        if self._last_written != (checkpoint_path, digest):
+            save_pickle(meta, checkpoint_path)
+            self._last_written = (checkpoint_path, digest)
+        if self._pointer_target != checkpoint_path:
+            # Only rewritten when the checkpoint file itself changes
+            save_pickle(checkpoint_path, self.latest_pointer_path)
+            self._pointer_target = checkpoint_path
+        completion_cache.persist(self.completion_cache_path)
+        print(f"[Checkpoint] Saved state at {datetime.now()}")
+
+    @staticmethod
+    def _report_failed_save(future):
+        error = future.exception()
+        if error is not None:
+            print(f"[Checkpoint] Background save failed: {error!r}")
+
+    def flush(self):
+        """Block until the last background save has finished (re-raising its error)."""
+        if self._pending_save is not None:
+            pending, self._pending_save = self._pending_save, None
+            pending.result()
+
+    def close(self):
+        """Wait for the last save, then stop the writer thread. No saves after this."""
+        try:
+            self.flush()
+        finally:
+            self._writer.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -1,5 +1,5 @@
+import numpy as np
 import pandas as pd
-import hashlib
 import streamlit as st
 
 from services.db import *
@@ -26,9 +26,10 @@ def handle_checkpoint_processing(
         print("\n" + "-" * 80 + "\n")
         sfw = load_sfw_file()
         sfw = sfw[sfw["Sector"].isin(target_sector)].reset_index(drop=True)
-        sfw["skill_lower"] = sfw["TSC_CCS Title"].str.lower().str.strip()
+        sfw["skill_lower"] = normalize_text(sfw["TSC_CCS Title"])
 
-        course_df = load_sector_file(
+        # Read the sector file once; Round 2 reuses it for the descriptions
+        sector_df = load_sector_file(
             cols=[
                 "Course Reference Number",
                 "Course Title",
@@ -38,16 +39,16 @@ def handle_checkpoint_processing(
             ],
         )
         course_df = (
-            course_df.drop_duplicates(subset=["Course Reference Number", "Skill Title"])
+            sector_df.drop_duplicates(subset=["Course Reference Number", "Skill Title"])
             .dropna()
             .reset_index(drop=True)
         )
 
         # Add these lines to match the preprocessing in handle_core_processing
-        course_df["skill_lower"] = course_df["Skill Title"].str.lower().str.strip()
+        course_df["skill_lower"] = normalize_text(course_df["Skill Title"])
         skill_set = set(sfw["skill_lower"])
-        course_df["Sector Relevance"] = course_df["skill_lower"].apply(
-            lambda x: "In Sector" if x in skill_set else "Not in sector"
+        course_df["Sector Relevance"] = np.where(
+            course_df["skill_lower"].isin(skill_set), "In Sector", "Not in sector"
         )
 
         # Save immediately out-of-sector skills if needed
@@ -65,41 +66,38 @@ def handle_checkpoint_processing(
         r1_results = resume_round_1(work_df, sfw, ckpt, progress_bar, caption)
 
         # === Round 1 Post-processing ===
-        r1_df = pd.DataFrame(r1_results)
-        r1_df["skill_lower"] = r1_df["Skill Title"].str.lower().str.strip()
-        merged1 = work_df.merge(r1_df, on=["Course Reference Number", "skill_lower"])
-        merged1["proficiency_level"] = merged1["proficiency_level"].astype(int)
-
-        # Sanity-check
-        valid1, invalid1 = [], []
-        pl_map = sfw.groupby("skill_lower")["Proficiency Level"].agg(set).to_dict()
-        for _, row in merged1.iterrows():
-            (
-                valid1
-                if row["proficiency_level"] in pl_map.get(row["skill_lower"], set())
-                else invalid1
-            ).append(row)
-
-        df_valid1 = pd.DataFrame(valid1)
-        df_invalid1 = pd.DataFrame(invalid1)
-
-        write_r1_valid_to_s3(df_valid1, target_sector_alias)
-        write_r1_invalid_to_s3(df_invalid1, target_sector_alias)
+        if ckpt.state.get("r1_outputs_written"):
+            # An earlier attempt already split and wrote Round 1; reuse it
+            df_valid1 = load_r1_valid()
+            df_invalid1 = load_r1_invalid()
+        else:
+            r1_df = pd.DataFrame(r1_results)
+            r1_df["skill_lower"] = normalize_text(r1_df["Skill Title"])
+            # Join keys as shared categoricals: the merges below hash int codes
+            to_shared_categories([work_df, r1_df, sfw], "skill_lower")
+            to_shared_categories([work_df, r1_df], "Course Reference Number")
+            merged1 = work_df.merge(
+                r1_df, on=["Course Reference Number", "skill_lower"]
+            )
+            merged1["proficiency_level"] = merged1["proficiency_level"].astype("int8")
+
+            # Sanity-check: a tag is valid if (skill, level) exists in the SFw
+            is_valid = sfw_level_mask(merged1, sfw)
+            df_valid1 = merged1[is_valid].reset_index(drop=True)
+            df_invalid1 = merged1[~is_valid].reset_index(drop=True)
+
+            write_r1_valid_to_s3(df_valid1, target_sector_alias)
+            write_r1_invalid_to_s3(df_invalid1, target_sector_alias)
+            # Record the write so a retry before Round 2 starts skips it
+            ckpt.state["r1_outputs_written"] = True
+            ckpt.save(wait=True)
 
         # === Round 2 Setup ===
         print("\n" + "-" * 80 + "\n")
         print("ROUND 2 PROCESS STARTING")
         print("\n" + "-" * 80 + "\n")
-        # Load course descriptions from original input (full load, then pick columns)
-        all_descr = load_sector_file(
-            cols=[
-                "Course Reference Number",
-                "Course Title",
-                "Skill Title",
-                "About This Course",
-                "What You'll Learn",
-            ],
-        )
+        # Course descriptions come from the sector file loaded for Round 1
+        all_descr = sector_df
         # strip any accidental leading/trailing spaces in the headers
         all_descr.columns = all_descr.columns.str.strip()
         # now slice out exactly the four description columns
@@ -126,38 +124,15 @@ def handle_checkpoint_processing(
             skill_cols = [c for c in df_r2_input.columns if c.startswith("Skill Title")]
             if skill_cols:
                 df_r2_input["Skill Title"] = df_r2_input[skill_cols[0]]
-                df_r2_input.drop(columns=skill_cols, inplace=True)
+                df_r2_input = df_r2_input.drop(columns=skill_cols)
 
         # ——— Coalesce Course Title, About This Course, What You'll Learn ———
-        for base in ["Course Title", "About This Course", "What You'll Learn"]:
-            x, y = f"{base}_x", f"{base}_y"
-            if x in df_r2_input.columns and y in df_r2_input.columns:
-                # prefer the _y (fresh descr_df) but fall back to _x if missing
-                df_r2_input[base] = df_r2_input[y].fillna(df_r2_input[x])
-                df_r2_input.drop(columns=[x, y], inplace=True)
-            elif x in df_r2_input.columns:
-                df_r2_input.rename(columns={x: base}, inplace=True)
-            elif y in df_r2_input.columns:
-                df_r2_input.rename(columns={y: base}, inplace=True)
-
-        # Now you can safely do:
-        df_r2_input["course_text"] = (
-            df_r2_input["Course Title"]
-            + " |: "
-            + df_r2_input["About This Course"]
-            + " | "
-            + df_r2_input["What You'll Learn"]
+        # prefer the _y (fresh descr_df) but fall back to _x if missing
+        df_r2_input = coalesce_merge_suffixes(
+            df_r2_input, ["Course Title", "About This Course", "What You'll Learn"]
         )
 
-        # ——— Generate unique_id to match resume_round2() logic ———
-        df_r2_input["unique_text"] = (
-            df_r2_input["course_text"] + df_r2_input["Skill Title"]
-        )
-        df_r2_input["unique_id"] = (
-            df_r2_input["unique_text"]
-            .str.lower()
-            .apply(lambda t: hashlib.sha256(t.encode()).hexdigest())
-        )
+        # course_text/unique_id are derived inside resume_round_2
 
         # Reset progress bar for Round 2
         if progress_bar:
@@ -181,6 +156,7 @@ def handle_checkpoint_processing(
             ckpt,
             progress_bar,
             caption,
+            r1_valid=df_valid1,
         )
 
         # Check if early exit was triggered
@@ -240,36 +216,15 @@ def handle_checkpoint_processing(
             skill_cols = [c for c in df_r2_input.columns if c.startswith("Skill Title")]
             if skill_cols:
                 df_r2_input["Skill Title"] = df_r2_input[skill_cols[0]]
-                df_r2_input.drop(columns=skill_cols, inplace=True)
+                df_r2_input = df_r2_input.drop(columns=skill_cols)
 
         # ——— Coalesce Course Title, About This Course, What You'll Learn ———
-        for base in ["Course Title", "About This Course", "What You'll Learn"]:
-            x, y = f"{base}_x", f"{base}_y"
-            if x in df_r2_input.columns and y in df_r2_input.columns:
-                df_r2_input[base] = df_r2_input[y].fillna(df_r2_input[x])
-                df_r2_input.drop(columns=[x, y], inplace=True)
-            elif x in df_r2_input.columns:
-                df_r2_input.rename(columns={x: base}, inplace=True)
-            elif y in df_r2_input.columns:
-                df_r2_input.rename(columns={y: base}, inplace=True)
-
-        # Recreate course_text and unique_id
-        df_r2_input["course_text"] = (
-            df_r2_input["Course Title"]
-            + " |: "
-            + df_r2_input["About This Course"]
-            + " | "
-            + df_r2_input["What You'll Learn"]
+        # prefer the _y (fresh descr_df) but fall back to _x if missing
+        df_r2_input = coalesce_merge_suffixes(
+            df_r2_input, ["Course Title", "About This Course", "What You'll Learn"]
         )
 
-        df_r2_input["unique_text"] = (
-            df_r2_input["course_text"] + df_r2_input["Skill Title"]
-        )
-        df_r2_input["unique_id"] = (
-            df_r2_input["unique_text"]
-            .str.lower()
-            .apply(lambda t: hashlib.sha256(t.encode()).hexdigest())
-        )
+        # course_text/unique_id are derived inside resume_round_2
 
         # Resume Round 2 processing
         r2_valid, r2_invalid, all_valid = resume_round_2(
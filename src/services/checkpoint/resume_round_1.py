@@ -1,21 +1,33 @@
 import time
 import streamlit as st
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-from services.llm_pipeline.r1_utils import process_row
-
-
-def resume_round_1(work_df, sfw_df, ckpt, progress_bar=None, caption=None):
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from services.llm_pipeline.r1_utils import PROCESS_ROW_COLS, process_row
+from services.llm_pipeline.openai_client import default_max_workers
+from config import LLM_REQUESTS_PER_MINUTE
+
+# A checkpoint is written after this many new rows or seconds, whichever first
+CHECKPOINT_EVERY_ROWS = 200
+CHECKPOINT_EVERY_SECONDS = 60
+# Minimum seconds between progress bar / ETA caption refreshes
+UI_UPDATE_SECONDS = 1.0
+
+
+def resume_round_1(
+    work_df, sfw_df, ckpt, progress_bar=None, caption=None, max_workers=None
+):
     """
     Batch-process Round 1 prompts with:
-      - 10 workers
-      - Sleep 10s every 40 calls
-      - Checkpoint every 30
+      - max_workers workers (default: default_max_workers())
+      - Requests paced by a shared token bucket in process_row
+      - Checkpoint every CHECKPOINT_EVERY_ROWS rows or CHECKPOINT_EVERY_SECONDS
       - Show tqdm progress bar and Streamlit progress
       - Display estimated time remaining
     """
     client = None
+    if max_workers is None:
+        max_workers = default_max_workers()
 
     # pull pending + results from checkpoint
     pending = ckpt.state["r1_pending"][:]  # list of idxs
@@ -27,63 +39,25 @@ def resume_round_1(work_df, sfw_df, ckpt, progress_bar=None, caption=None):
         total=total, initial=len(results), desc="Round1 rows processed", unit="row"
     )
 
-    skill_info, lock = {}, Lock()
-    api_calls = len(results)
-    processed = len(results)
+    skill_info = {}
+    processed = processed_at_start = len(results)
 
     # Track start time for better estimation
     start_time = time.time()
 
-    def update_caption_with_eta(processed, total, api_calls):
+    def update_caption_with_eta(processed, total):
         if caption is not None:
             remaining = total - processed
             elapsed = time.time() - start_time
+            done_now = processed - processed_at_start
 
-            if processed > 0:
-                # Calculate how many sleep periods we've had and will have
-                sleeps_completed = api_calls // 60
-                total_sleep_time_so_far = sleeps_completed * 10  # 10s per sleep
-
-                # Calculate remaining sleeps
-                remaining_calls = remaining
-                current_batch_position = api_calls % 60
-
-                # Calculate future sleeps more accurately
-                if current_batch_position + remaining_calls <= 60:
-                    # All remaining calls fit in current batch
-                    future_sleeps = 0
-                else:
-                    # Calculate how many complete batches remain after current
-                    calls_to_complete_current_batch = 60 - current_batch_position
-                    calls_after_current_batch = (
-                        remaining_calls - calls_to_complete_current_batch
-                    )
-                    future_sleeps = 1 + (calls_after_current_batch // 60)
-
-                # Pure processing time (without sleeps)
-                pure_processing_time = elapsed - total_sleep_time_so_far
-
-                if pure_processing_time > 0:
-                    # Calculate rate based on pure processing time
-                    actual_processing_rate = processed / pure_processing_time
-
-                    # Estimate remaining processing time
-                    remaining_processing_time = remaining / actual_processing_rate
-
-                    # Add future sleep time
-                    remaining_sleep_time = future_sleeps * 10
-
-                    # Total ETA
-                    eta_seconds = remaining_processing_time + remaining_sleep_time
-                else:
-                    # Fallback if we haven't processed enough yet
-                    eta_seconds = remaining * 0.6  # rough estimate: 0.6s per item
+            if done_now > 0 and elapsed > 0:
+                # Pacing happens per request in the workers, so the observed
+                # rate already includes any rate-limit waits
+                eta_seconds = remaining * elapsed / done_now
             else:
-                # Initial estimate - be conservative
-                estimated_sleeps = total // 60
-                eta_seconds = (total * 0.6) + (
-                    estimated_sleeps * 10
-                )  # Format user-friendly time display
+                # Initial estimate: ~0.6s per row, or the request budget if slower
+                eta_seconds = remaining * max(0.6, 60 / LLM_REQUESTS_PER_MINUTE)
             if eta_seconds > 3600:  # More than 1 hour
                 hours = int(eta_seconds // 3600)
                 minutes = int((eta_seconds % 3600) // 60)
@@ -104,64 +78,84 @@ def resume_round_1(work_df, sfw_df, ckpt, progress_bar=None, caption=None):
             caption.caption(f"[Status] Processing 1st Stage... {time_display}")
 
     # Initial caption update
-    update_caption_with_eta(processed, total, api_calls)
-
-    while pending:
-
-        batch = pending[:10]
-        pending = pending[10:]
-        rows = work_df.loc[batch]
-
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {
-                executor.submit(
-                    process_row, rows.loc[idx], skill_info, sfw_df, lock
-                ): idx
-                for idx in batch
-            }
-            for fut in as_completed(futures):
+    update_caption_with_eta(processed, total)
+    last_ui_update = time.monotonic()
+
+    # One pool for the whole run, kept full: a slot freed by a finished row is
+    # refilled straight away instead of waiting for the rest of its batch
+    queued = deque(pending)
+    in_flight = {}
+    # Rows as plain dicts of just the fields process_row reads, built once on
+    # this thread: workers never touch pandas
+    rows = dict(
+        zip(pending, work_df.loc[pending, PROCESS_ROW_COLS].to_dict(orient="records"))
+    )
+
+    def remaining():
+        # Rows still to do, in-flight ones included, for the checkpoint
+        return list(in_flight.values()) + list(queued)
+
+    last_saved_count, last_saved_time = processed, time.monotonic()
+
+    def maybe_checkpoint(force=False):
+        # Save once enough new rows or time have accumulated, or when forced
+        nonlocal last_saved_count, last_saved_time
+        due = (
+            processed - last_saved_count >= CHECKPOINT_EVERY_ROWS
+            or time.monotonic() - last_saved_time >= CHECKPOINT_EVERY_SECONDS
+        )
+        if not (force or due):
+            return
+        ckpt.state["r1_pending"] = remaining()
+        ckpt.state["r1_results"] = results
+        ckpt.last_progress = processed / total  # Save progress for main pipeline
+        ckpt.save(wait=force)
+        last_saved_count, last_saved_time = processed, time.monotonic()
+        print(f"Checkpoint saved at {processed}/{total} rows processed.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit_next():
+            idx = queued.popleft()
+            fut = executor.submit(process_row, rows.pop(idx), skill_info, sfw_df)
+            in_flight[fut] = idx
+
+        while queued and len(in_flight) < max_workers:
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                in_flight.pop(fut)
                 try:
                     res = fut.result()
                     results.append(res)
-                    api_calls += 1
                     processed += 1
                     pbar.update(1)
 
-                    # Update streamlit progress
-                    if progress_bar is not None:
-                        progress = processed / total
-                        progress_bar.progress(progress)
-
-                    # Update caption with ETA
-                    update_caption_with_eta(processed, total, api_calls)
-
-                    if api_calls % 60 == 0:
-                        print(
-                            "[RateLimiter] ⏸ Pausing for 10 seconds to respect API rate limits..."
-                        )
-                        time.sleep(10)
-
-                    if processed % 30 == 0:
-                        # checkpoint every 30 processed
-                        ckpt.state["r1_pending"] = pending
-                        ckpt.state["r1_results"] = results
-                        ckpt.last_progress = (
-                            processed / total
-                        )  # Save progress for main pipeline
-                        ckpt.save()
-                        print(
-                            f"Checkpoint saved at {processed}/{total} rows processed."
-                        )
+                    # Each Streamlit update is a websocket message; refreshing
+                    # the bar and ETA once a second looks the same
+                    now = time.monotonic()
+                    if now - last_ui_update >= UI_UPDATE_SECONDS or processed == total:
+                        last_ui_update = now
+                        if progress_bar is not None:
+                            progress_bar.progress(processed / total)
+                        update_caption_with_eta(processed, total)
+
+                    maybe_checkpoint()
                 except Exception as e:
                     error_msg = f"Round1 error: {e}"
                     print(error_msg)
                     st.error(error_msg)
+                if queued:
+                    submit_next()
+
+    # Last refresh, in case the final rows landed inside the throttle window
+    if progress_bar is not None and total:
+        progress_bar.progress(processed / total)
 
     # final checkpoint
-    ckpt.state["r1_pending"] = pending
-    ckpt.state["r1_results"] = results
-    ckpt.last_progress = processed / total  # Save final progress
-    ckpt.save()
+    maybe_checkpoint(force=True)
 
     pbar.close()
     return results
@@ -1,21 +1,64 @@
 # file: services/llm_pipeline/resume_round_2.py
 import pandas as pd
-import hashlib
 import time
 
 # Removed streamlit import
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 from services.llm_pipeline.r2_utils import *
+from services.llm_pipeline.openai_client import default_max_workers
+
+# Both rounds call the same endpoint, so Round 2 workers take from Round 1's
+# bucket: one budget, with no fresh burst allowance when Round 2 starts
+from services.llm_pipeline.r1_utils import request_bucket
 from services.checkpoint.checkpoint_manager import CheckpointManager
-from config import skill_proficiency_level_details
+from utils.processing_utils import (
+    build_course_text,
+    build_unique_ids,
+    normalize_text,
+    sfw_level_mask,
+    to_shared_categories,
+)
+from config import LLM_REQUESTS_PER_MINUTE, skill_proficiency_level_details
 
 
 from services.db.data_loaders import (
     load_r1_valid,
 )
 
+# A checkpoint is written after this many new rows or seconds, whichever first
+CHECKPOINT_EVERY_ROWS = 200
+CHECKPOINT_EVERY_SECONDS = 60
+# Minimum seconds between progress bar / ETA caption refreshes
+UI_UPDATE_SECONDS = 1.0
+
+# Round 2 results are kept as (unique_id, pl, reason, confidence) tuples:
+# far smaller than a dict per row, and one from_records call frames them
+R2_RESULT_COLUMNS = [
+    "unique_id",
+    "proficiency_level_rac_chart",
+    "reason_rac_chart",
+    "confidence_rac_chart",
+]
+
+
+def _clean_valid_columns(df):
+    """
+    Drop merge leftovers ("invalid_pl", "Skill Title_y", duplicate columns)
+    and keep a single "Skill Title", taken from "Skill Title_x" if needed.
+    """
+    df = df.loc[:, ~df.columns.duplicated()].drop(
+        columns=["invalid_pl", "Skill Title_y"], errors="ignore"
+    )
+    if "Skill Title_x" in df.columns:
+        if "Skill Title" in df.columns:
+            df = df.drop(columns="Skill Title_x")
+        else:
+            df = df.rename(columns={"Skill Title_x": "Skill Title"})
+    return df
+
 
 def resume_round_2(
     target_sector: str,
@@ -25,52 +68,74 @@ def resume_round_2(
     ckpt: CheckpointManager,
     progress_bar=None,
     caption=None,
+    r1_valid: pd.DataFrame = None,
+    max_workers: int = None,
 ):
     """
     Process Round 2 on the "invalid" from Round 1, exactly as in round2_processing.py,
-    with batching (10 at a time), a 50s pause every 40 API calls, a checkpoint every 30 rows,
-    and a tqdm progress bar plus Streamlit progress updates.
+    with up to max_workers rows in flight (default: default_max_workers()),
+    requests paced by the token bucket shared with Round 1, a checkpoint
+    every CHECKPOINT_EVERY_ROWS rows or CHECKPOINT_EVERY_SECONDS, and a tqdm
+    progress bar plus Streamlit progress updates.
     """
-
-    # 1) Reconstruct the original "data"
-    data = df_invalid.copy()
-    data["course_text"] = (
-        data["Course Title"]
-        + " |: "
-        + data["About This Course"]
-        + " | "
-        + data["What You'll Learn"]
-    )
-    data["unique_text"] = data["course_text"] + data["Skill Title"]
-    data["unique_id"] = data["unique_text"].apply(
-        lambda x: hashlib.sha256(x.lower().encode()).hexdigest()
-    )
+    if max_workers is None:
+        max_workers = default_max_workers()
+
+    # 1) Reconstruct the original "data". Copy-on-Write (enabled in app.py)
+    # lets it share df_invalid's column blocks instead of deep-copying them
+    data = df_invalid.assign(course_text=build_course_text(df_invalid))
+    data["unique_id"] = build_unique_ids(data["course_text"], data["Skill Title"])
+    # Normalise skill titles once on each side; the KB lookups and the SFw
+    # sanity check below all key on these columns
+    data["skill_lower"] = normalize_text(data["Skill Title"])
+    sfw_skills = sfw_raw.assign(skill_lower=normalize_text(sfw_raw["TSC_CCS Title"]))
 
     # 2) Build KB dictionary
-    kb_dic = (
-        sfw_raw.query("Sector in @target_sector")
-        .assign(
-            skill_lower=lambda df: df["TSC_CCS Title"].str.lower().str.strip(),
-            items=lambda df: df["Knowledge / Ability Items"].fillna(""),
-        )
-        .groupby("skill_lower")
-        .apply(
-            lambda sub: (
-                sub.groupby("Proficiency Level")["items"]
-                .apply(", ".join)
-                .reset_index()
-                .to_dict(orient="records")
-            ),
-            include_groups=False,
-        )
-        .to_dict()
+    # One (skill, level) aggregation, folded into per-skill records in one
+    # pass over its items; no per-skill DataFrames are materialised
+    kb_items = (
+        sfw_skills.query("Sector in @target_sector")
+        .assign(items=lambda df: df["Knowledge / Ability Items"].fillna(""))
+        .groupby(["skill_lower", "Proficiency Level"])["items"]
+        .agg(", ".join)
     )
+    kb_dic = {}
+    for (skill, level), items in kb_items.items():
+        kb_dic.setdefault(skill, []).append(
+            {"Proficiency Level": level, "items": items}
+        )
+    # Resolve each row's KB text once; the prompt builder only concatenates
+    data = add_kb_snippets(data, kb_dic)
+    # Rows with zero or one KB level need no LLM call at all
+    data["direct_result"] = direct_results(data, kb_dic)
+    chart_text = str(skill_proficiency_level_details)
+    # Everything in the prompt after the course text depends only on the skill
+    skills = data.drop_duplicates("Skill Title")
+    skill_context = {
+        skill: build_skill_context(kb_snippet, skill, chart_text)
+        for skill, kb_snippet in zip(skills["Skill Title"], skills["kb_snippet"])
+    }
+
+    # Pull the columns the loop reads out once, as plain lists indexed by
+    # position, instead of boxing a Series per row with iterrows
+    row_uids = data["unique_id"].tolist()
+    row_direct = data["direct_result"].tolist()
+    row_texts = data["course_text"].tolist()
+    row_skills = data["Skill Title"].tolist()
 
     # 3) Prepare for batching & progress
     pending = ckpt.state.get("r2_pending", list(range(len(data))))
-    results = ckpt.state.get("r2_results", [])
-    api_calls = len(results)
-    processed = len(results)
+    results = list(ckpt.state.get("r2_results", []))
+    # Dict results come from checkpoints older than the uint64 ids: their hex
+    # unique_ids match no row any more, so Round 2 starts over for those
+    if any(isinstance(r, dict) for r in results):
+        print("[Round2] Checkpoint predates uint64 ids; restarting Round 2.")
+        pending, results = list(range(len(data))), []
+    # Rows sharing a unique_id share a prompt, and the merge keeps one result
+    # per id, so only the first pending row of each id is built and sent
+    seen = {r[0] for r in results}
+    pending = [i for i in pending if not (row_uids[i] in seen or seen.add(row_uids[i]))]
+    processed = processed_at_start = len(results)
 
     total = len(pending) + len(results)
 
@@ -81,56 +146,19 @@ def resume_round_2(
     # Track start time for better estimation
     start_time = time.time()
 
-    def update_caption_with_eta(processed, total, api_calls):
+    def update_caption_with_eta(processed, total):
         if caption is not None:
             remaining = total - processed
             elapsed = time.time() - start_time
+            done_now = processed - processed_at_start
 
-            if processed > 0:
-                # Calculate how many sleep periods we've had and will have
-                sleeps_completed = api_calls // 60
-                total_sleep_time_so_far = sleeps_completed * 10  # 10s per sleep
-
-                # Calculate remaining sleeps
-                remaining_calls = remaining
-                current_batch_position = api_calls % 60
-
-                # Calculate future sleeps more accurately
-                if current_batch_position + remaining_calls <= 60:
-                    # All remaining calls fit in current batch
-                    future_sleeps = 0
-                else:
-                    # Calculate how many complete batches remain after current
-                    calls_to_complete_current_batch = 60 - current_batch_position
-                    calls_after_current_batch = (
-                        remaining_calls - calls_to_complete_current_batch
-                    )
-                    future_sleeps = 1 + (calls_after_current_batch // 60)
-
-                # Pure processing time (without sleeps)
-                pure_processing_time = elapsed - total_sleep_time_so_far
-
-                if pure_processing_time > 0:
-                    # Calculate rate based on pure processing time
-                    actual_processing_rate = processed / pure_processing_time
-
-                    # Estimate remaining processing time
-                    remaining_processing_time = remaining / actual_processing_rate
-
-                    # Add future sleep time
-                    remaining_sleep_time = future_sleeps * 10
-
-                    # Total ETA
-                    eta_seconds = remaining_processing_time + remaining_sleep_time
-                else:
-                    # Fallback if we haven't processed enough yet
-                    eta_seconds = remaining * 0.6  # rough estimate: 0.6s per item
+            if done_now > 0 and elapsed > 0:
+                # Pacing happens per request in the workers, so the observed
+                # rate already includes any rate-limit waits
+                eta_seconds = remaining * elapsed / done_now
             else:
-                # Initial estimate - be conservative
-                estimated_sleeps = total // 60
-                eta_seconds = (total * 0.6) + (
-                    estimated_sleeps * 10
-                )  # Format user-friendly time display
+                # Initial estimate: ~0.6s per row, or the request budget if slower
+                eta_seconds = remaining * max(0.6, 60 / LLM_REQUESTS_PER_MINUTE)
             if eta_seconds > 3600:  # More than 1 hour
                 hours = int(eta_seconds // 3600)
                 minutes = int((eta_seconds % 3600) // 60)
@@ -151,195 +179,173 @@ def resume_round_2(
             caption.caption(f"[Status] Processing 2nd Stage... {time_display}")
 
     # Initial caption update
-    update_caption_with_eta(processed, total, api_calls)
-
-    # 4) Process in batches of 10
-    while pending:
-
-        batch_idx = pending[:10]
-        pending = pending[10:]
-        batch_df = data.iloc[batch_idx].reset_index(drop=True)
-
-        with ThreadPoolExecutor(max_workers=10) as exec:
-            futures = []
-            for _, row in batch_df.iterrows():
-                sys_msg = form_sys_msg(
-                    kb_dic,
-                    row["course_text"],
-                    row["Skill Title"],
-                    skill_proficiency_level_details,
-                )
-                futures.append(
-                    (row["unique_id"], exec.submit(get_gpt_completion, sys_msg))
+    update_caption_with_eta(processed, total)
+    last_ui_update = time.monotonic()
+
+    # 4) Process with one pool kept full: a slot freed by a finished row is
+    # refilled straight away, so at most max_workers rows are ever in flight
+    queued = deque(pending)
+    in_flight = {}
+
+    def remaining():
+        # Rows still to do, in-flight ones included, for the checkpoint
+        return list(in_flight.values()) + list(queued)
+
+    last_saved_count, last_saved_time = processed, time.monotonic()
+
+    def maybe_checkpoint(force=False):
+        # Save once enough new rows or time have accumulated, or when forced.
+        # save() hands the snapshot to the manager's writer thread and only
+        # appends new results, so the drain loop never waits on storage.
+        nonlocal last_saved_count, last_saved_time
+        due = (
+            processed - last_saved_count >= CHECKPOINT_EVERY_ROWS
+            or time.monotonic() - last_saved_time >= CHECKPOINT_EVERY_SECONDS
+        )
+        if not (force or due):
+            return
+        ckpt.state["r2_pending"] = remaining()
+        ckpt.state["r2_results"] = results
+        ckpt.last_progress = processed / total  # Save progress for main pipeline
+        ckpt.save(wait=force)
+        last_saved_count, last_saved_time = processed, time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as exec:
+
+        def submit_next():
+            i = queued.popleft()
+            # Rows with a mechanical answer skip prompt building and the API.
+            # Everything else goes through get_gpt_completion, whose cache is
+            # keyed on the full prompt, so a new KB or chart never hits it.
+            if row_direct[i] is not None:
+                fut = Future()
+                fut.set_result(row_direct[i])
+            else:
+                sys_msg = form_sys_msg_from_context(
+                    row_texts[i], skill_context[row_skills[i]]
                 )
+                fut = exec.submit(get_gpt_completion, sys_msg, rpm=request_bucket)
+            in_flight[fut] = i
+
+        while queued and len(in_flight) < max_workers:
+            submit_next()
 
-            for uid, fut in futures:
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                uid = row_uids[in_flight.pop(fut)]
                 try:
                     out = fut.result()
                     results.append(
-                        {
-                            "unique_id": uid,
-                            "pl": out.get("proficiency", 0),
-                            "reason": out.get("reason", ""),
-                            "confidence": out.get("confidence", ""),
-                        }
+                        (
+                            uid,
+                            out.get("proficiency", 0),
+                            out.get("reason", ""),
+                            out.get("confidence", ""),
+                        )
                     )
                 except Exception as e:
                     error_msg = f"Round2 failed for {uid}: {e}"
                     # print(f"[ERROR] {error_msg}")  # debug removed
-                    results.append(
-                        {"unique_id": uid, "pl": 0, "reason": "", "confidence": ""}
-                    )
+                    results.append((uid, 0, "", ""))
 
-                api_calls += 1
                 processed += 1
                 pbar.update(1)
 
-                # Update streamlit progress
-                if progress_bar is not None:
-                    progress = processed / total
-                    progress_bar.progress(progress)
-
-                # Update caption with ETA
-                update_caption_with_eta(processed, total, api_calls)
-
-                # rate-limit pause
-                if api_calls % 60 == 0:
-                    # print("[RateLimiter] ⏸ Pausing for 10 seconds to respect API rate limits...")
-                    time.sleep(10)
-
-                # checkpoint every 30 rows
-                if processed % 30 == 0:
-                    # print(f"Checkpoint saved at {processed}/{total} rows processed.")
-                    ckpt.state["r2_pending"] = pending
-                    ckpt.state["r2_results"] = results
-                    ckpt.last_progress = (
-                        processed / total
-                    )  # Save progress for main pipeline
-                    ckpt.save()
+                # Each Streamlit update is a websocket message; refreshing
+                # the bar and ETA once a second looks the same
+                now = time.monotonic()
+                if now - last_ui_update >= UI_UPDATE_SECONDS or processed == total:
+                    last_ui_update = now
+                    if progress_bar is not None:
+                        progress_bar.progress(processed / total)
+                    update_caption_with_eta(processed, total)
+
+                maybe_checkpoint()
+
+                if queued:
+                    submit_next()
+
+    # Last refresh, in case the final rows landed inside the throttle window
+    if progress_bar is not None and total:
+        progress_bar.progress(processed / total)
 
     # final checkpoint
-    ckpt.state["r2_pending"] = pending
-    ckpt.state["r2_results"] = results
-    ckpt.last_progress = processed / total  # Save final progress
-    ckpt.save()
+    maybe_checkpoint(force=True)
 
     pbar.close()
 
-    result_df = pd.DataFrame(
-        {
-            "unique_id": [r["unique_id"] for r in results],
-            "proficiency_level_rac_chart": [r["pl"] for r in results],
-            "reason_rac_chart": [r["reason"] for r in results],
-            "confidence_rac_chart": [r["confidence"] for r in results],
-        }
+    # Indexed by the uint64 unique_id, so the merge probes the right side's
+    # index directly. Rows sharing an id have the same course text and skill,
+    # so one result per id is kept and the merge cannot fan rows out.
+    result_df = pd.DataFrame.from_records(results, columns=R2_RESULT_COLUMNS)
+    result_df = result_df.set_index(result_df["unique_id"].astype("uint64")).drop(
+        columns="unique_id"
     )
+    result_df = result_df[~result_df.index.duplicated()]
 
-    # b) Merge back into data
-    sub = result_df[result_df.unique_id.isin(data.unique_id)]
-    merged = data.merge(sub, on="unique_id", how="left")
+    # b) Merge back into data; a left merge already ignores ids not in data
+    merged = data.merge(result_df, left_on="unique_id", right_index=True, how="left")
 
     total = data.shape[0]
 
-    # d) Drop helper columns and save raw
-    merged.drop(columns=["course_text", "unique_text", "unique_id"], inplace=True)
-    merged["proficiency_level"] = merged["proficiency_level"].astype(int)
+    # d) Drop helper columns and save raw. Under Copy-on-Write a plain drop
+    # shares the remaining blocks, where inplace=True would rebuild them.
+    # skill_lower stays: it is the SFw check's key and part of the outputs.
+    merged = merged.drop(
+        columns=[
+            "course_text",
+            "unique_id",
+            "kb_snippet",
+            "direct_result",
+        ]
+    )
+    # Levels are 0-6, so int8 suffices; rows without a result count as untagged
+    merged["proficiency_level"] = merged["proficiency_level"].astype("int8")
+    merged["proficiency_level_rac_chart"] = (
+        pd.to_numeric(merged["proficiency_level_rac_chart"], errors="coerce")
+        .fillna(0)
+        .astype("int8")
+    )
 
     # e) Split untagged vs tagged
     r2_untagged = merged[merged.proficiency_level_rac_chart == 0]
     r2_tagged = merged[merged.proficiency_level_rac_chart > 0].reset_index(drop=True)
 
-    # f) Sanity-check vs SFw
-    sanity = (
-        r2_tagged.groupby("Skill Title")["proficiency_level_rac_chart"]
-        .agg(set)
-        .reset_index()
-    )
-    sfw_sets = (
-        sfw_raw.groupby("TSC_CCS Title")["Proficiency Level"]
-        .agg(set)
-        .reset_index()
-        .assign(skill_lower=lambda df: df["TSC_CCS Title"].str.lower().str.strip())
+    # f) Sanity-check vs SFw: anti-join tagged (skill, level) pairs against the SFw
+    # Shared categorical keys, as in Round 1: the merge hashes int codes
+    to_shared_categories([r2_tagged, sfw_skills], "skill_lower")
+    is_valid = sfw_level_mask(
+        r2_tagged, sfw_skills, level_col="proficiency_level_rac_chart"
     )
 
-    violations = []
-    for skill, plset in zip(
-        sanity["Skill Title"], sanity["proficiency_level_rac_chart"]
-    ):
-        skill_matches = sfw_sets[sfw_sets["skill_lower"] == skill.lower().strip()]
-        if not skill_matches.empty:
-            valid = skill_matches["Proficiency Level"].iloc[0]
-        else:
-            valid = set()
-        bad = [p for p in plset if p not in valid]
-        if bad:
-            violations.append({"skill": skill, "invalid_pl": bad})
-
     # g) Build final valid/invalid sets
-    if not violations:
-        # all tagged are fine
-        r2_valid = r2_tagged
-        r2_invalid = r2_untagged.copy()
-    else:
-        vdf = (
-            pd.DataFrame(violations)
-            .explode("invalid_pl")
-            .assign(skill_lower=lambda df: df.skill.str.lower().str.strip())
-        )
-        vf = (
-            pd.merge(
-                r2_tagged,
-                vdf,
-                left_on=["skill_lower", "proficiency_level_rac_chart"],
-                right_on=["skill_lower", "invalid_pl"],
-                how="outer",
-            )
-            .fillna(9)
-            .infer_objects()
-        )
-
-        vf["invalid_pl"] = vf["invalid_pl"].astype(int)
-
-        r2_valid = vf[vf.invalid_pl == 9].drop(columns=["invalid_pl", "skill"])
-        bad2 = vf[vf.invalid_pl < 9].drop(columns=["invalid_pl", "skill"])
-        r2_invalid = pd.concat([r2_untagged, bad2], ignore_index=True)
-
-    # h) Merge with R1 valid, save all three files
-    r1_valid = load_r1_valid()
-
-    r2_vout = r2_valid.copy()
-    r2_vout["proficiency_level"] = r2_vout["proficiency_level_rac_chart"]
-    r2_vout["reason"] = r2_vout["reason_rac_chart"]
-    r2_vout.drop(
+    r2_valid = r2_tagged[is_valid].reset_index(drop=True)
+    bad2 = r2_tagged[~is_valid]
+    r2_invalid = pd.concat([r2_untagged, bad2], ignore_index=True)
+
+    # h) Merge with R1 valid, save all three files. Callers that just ran
+    # Round 1 pass it in; only a resumed Round 2 reads it back from storage.
+    if r1_valid is None:
+        r1_valid = load_r1_valid()
+
+    r2_vout = r2_valid.assign(
+        proficiency_level=r2_valid["proficiency_level_rac_chart"],
+        reason=r2_valid["reason_rac_chart"],
+    ).drop(
         columns=[
             "proficiency_level_rac_chart",
             "reason_rac_chart",
             "confidence_rac_chart",
-        ],
-        inplace=True,
+        ]
     )
 
-    # Concatenate first, then handle duplicate columns
-    all_valid = pd.concat([r1_valid, r2_vout], ignore_index=True)
-
-    # Remove any duplicate columns using pandas loc with unique column selection
-    # This is more robust than manual iteration
-    all_valid = all_valid.loc[:, ~all_valid.columns.duplicated()]
-
-    # Check for column existence in the concatenated dataframe before dropping
-    columns_to_drop = ["invalid_pl", "Skill Title_y"]
-    columns_to_drop = [col for col in columns_to_drop if col in all_valid.columns]
-
-    # Drop the identified columns
-    if columns_to_drop:
-        all_valid = all_valid.drop(columns=columns_to_drop, errors="ignore")
-
-    # Handle the Skill Title columns - rename _x version and drop any duplicate
-    if "Skill Title_x" in all_valid.columns:
-        all_valid = all_valid.rename(columns={"Skill Title_x": "Skill Title"})
-        # After renaming, remove duplicates again if any were created
-        all_valid = all_valid.loc[:, ~all_valid.columns.duplicated()]
+    # Give both sides the same clean columns first, so one concat builds the
+    # final frame with no suffix or duplicate-column clean-up afterwards
+    all_valid = pd.concat(
+        [_clean_valid_columns(r1_valid), _clean_valid_columns(r2_vout)],
+        ignore_index=True,
+    )
 
-    r2_invalid = pd.concat([r2_untagged, r2_invalid], ignore_index=True)
     # The return type here is a tuple of DataFrames
     return r2_valid, r2_invalid, all_valid
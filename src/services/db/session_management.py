@@ -18,6 +18,7 @@ from config import (
     CHECKPOINT_PATH,
 )
 from services.storage import delete_all
+from services.llm_pipeline.completion_cache import completion_cache
 from services.db import check_pkl_existence
 
 
@@ -49,6 +50,10 @@ def wipe_db(caption):
     ]:
         delete_all(path)
 
+    # The persisted cache went with CHECKPOINT_PATH; drop the in-memory copy
+    # too, so the next run in this process starts from a clean cache
+    completion_cache.clear()
+
     # Reset session state flags
     st.session_state["csv_yes"] = False
     st.session_state["pkl_yes"] = False
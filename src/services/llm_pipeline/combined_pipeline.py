@@ -1,5 +1,5 @@
-import hashlib
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import streamlit as st
 from config import *
@@ -22,7 +22,17 @@ def handle_core_processing(caption, target_sector, target_sector_alias):
     """
     progress_bar = st.progress(0)
 
-    ckpt = CheckpointManager(target_sector_alias, TIMESTAMP)
+    # Closing the manager waits for the last background save, on every exit
+    # path: fresh run, checkpoint resume, early exit or error
+    with CheckpointManager(target_sector_alias, TIMESTAMP) as ckpt:
+        return _run_core_processing(
+            caption, target_sector, target_sector_alias, ckpt, progress_bar
+        )
+
+
+def _run_core_processing(
+    caption, target_sector, target_sector_alias, ckpt, progress_bar
+):
     # If checkpoint exists, try to load it
     if ckpt.load():
         caption.caption("[Status] Retrieving Checkpoint Metadata...")
@@ -46,20 +56,21 @@ def handle_core_processing(caption, target_sector, target_sector_alias):
     # === Round 1 Setup ===
     sfw = load_sfw_file()
     sfw = sfw[sfw["Sector"].isin(target_sector)].reset_index(drop=True)
-    sfw["skill_lower"] = sfw["TSC_CCS Title"].str.lower().str.strip()
+    sfw["skill_lower"] = normalize_text(sfw["TSC_CCS Title"])
 
-    course_df = load_sector_file(cols=COURSE_DATA_COLUMNS)
+    # Read the sector file once; Round 2 reuses it for the descriptions
+    sector_df = load_sector_file(cols=COURSE_DATA_COLUMNS)
     course_df = (
-        course_df.drop_duplicates(subset=["Course Reference Number", "Skill Title"])
+        sector_df.drop_duplicates(subset=["Course Reference Number", "Skill Title"])
         .dropna()
         .reset_index(drop=True)
     )
-    course_df["skill_lower"] = course_df["Skill Title"].str.lower().str.strip()
+    course_df["skill_lower"] = normalize_text(course_df["Skill Title"])
 
     # Save immediately out-of-sector skills
     skill_set = set(sfw["skill_lower"])
-    course_df["Sector Relevance"] = course_df["skill_lower"].apply(
-        lambda x: "In Sector" if x in skill_set else "Not in sector"
+    course_df["Sector Relevance"] = np.where(
+        course_df["skill_lower"].isin(skill_set), "In Sector", "Not in sector"
     )
     irrelevant_initial = course_df[course_df["Sector Relevance"] == "Not in sector"]
     # irrelevant_initial.to_csv(irrelevant_output_path, index=False, encoding="utf-8")
@@ -78,33 +89,30 @@ def handle_core_processing(caption, target_sector, target_sector_alias):
 
     # === Round 1 Post-processing ===
     r1_df = pd.DataFrame(r1_results)
-    r1_df["skill_lower"] = r1_df["Skill Title"].str.lower().str.strip()
+    r1_df["skill_lower"] = normalize_text(r1_df["Skill Title"])
+    # Join keys as shared categoricals: the merges below hash int codes
+    to_shared_categories([work_df, r1_df, sfw], "skill_lower")
+    to_shared_categories([work_df, r1_df], "Course Reference Number")
     merged1 = work_df.merge(r1_df, on=["Course Reference Number", "skill_lower"])
-    merged1["proficiency_level"] = merged1["proficiency_level"].astype(int)
+    merged1["proficiency_level"] = merged1["proficiency_level"].astype("int8")
 
-    # Sanity-check
-    valid1, invalid1 = [], []
-    pl_map = sfw.groupby("skill_lower")["Proficiency Level"].agg(set).to_dict()
-    for _, row in merged1.iterrows():
-        (
-            valid1
-            if row["proficiency_level"] in pl_map.get(row["skill_lower"], set())
-            else invalid1
-        ).append(row)
-
-    df_valid1 = pd.DataFrame(valid1)
-    df_invalid1 = pd.DataFrame(invalid1)
+    # Sanity-check: a tag is valid if (skill, level) exists in the SFw
+    is_valid = sfw_level_mask(merged1, sfw)
+    df_valid1 = merged1[is_valid].reset_index(drop=True)
+    df_invalid1 = merged1[~is_valid].reset_index(drop=True)
 
     write_r1_valid_to_s3(df_valid1, target_sector_alias)
     write_r1_invalid_to_s3(df_invalid1, target_sector_alias)
+    # A resume that lands before Round 2 starts reloads these instead
+    ckpt.state["r1_outputs_written"] = True
+    ckpt.save(wait=True)
 
     # === Round 2 Setup ===
-    # Load course descriptions from original input (full load, then pick columns)
     print("\n" + "-" * 80 + "\n")
     print("ROUND 2 PROCESS STARTING")
     print("\n" + "-" * 80 + "\n")
-    # load sector file
-    all_descr = load_sector_file(cols=COURSE_DATA_COLUMNS)
+    # Course descriptions come from the sector file loaded for Round 1
+    all_descr = sector_df
     # strip any accidental leading/trailing spaces in the headers
     all_descr.columns = all_descr.columns.str.strip()
     # now slice out exactly the four description columns
@@ -122,36 +130,15 @@ def handle_core_processing(caption, target_sector, target_sector_alias):
         skill_cols = [c for c in df_r2_input.columns if c.startswith("Skill Title")]
         if skill_cols:
             df_r2_input["Skill Title"] = df_r2_input[skill_cols[0]]
-            df_r2_input.drop(columns=skill_cols, inplace=True)
+            df_r2_input = df_r2_input.drop(columns=skill_cols)
 
     # ——— Coalesce Course Title, About This Course, What You'll Learn ———
-    for base in ["Course Title", "About This Course", "What You'll Learn"]:
-        x, y = f"{base}_x", f"{base}_y"
-        if x in df_r2_input.columns and y in df_r2_input.columns:
-            # prefer the _y (fresh descr_df) but fall back to _x if missing
-            df_r2_input[base] = df_r2_input[y].fillna(df_r2_input[x])
-            df_r2_input.drop(columns=[x, y], inplace=True)
-        elif x in df_r2_input.columns:
-            df_r2_input.rename(columns={x: base}, inplace=True)
-        elif y in df_r2_input.columns:
-            df_r2_input.rename(columns={y: base}, inplace=True)
-
-    # Now you can safely do:
-    df_r2_input["course_text"] = (
-        df_r2_input["Course Title"]
-        + " |: "
-        + df_r2_input["About This Course"]
-        + " | "
-        + df_r2_input["What You'll Learn"]
+    # prefer the _y (fresh descr_df) but fall back to _x if missing
+    df_r2_input = coalesce_merge_suffixes(
+        df_r2_input, ["Course Title", "About This Course", "What You'll Learn"]
     )
 
-    # ——— Generate unique_id to match resume_round2() logic ———
-    df_r2_input["unique_text"] = df_r2_input["course_text"] + df_r2_input["Skill Title"]
-    df_r2_input["unique_id"] = (
-        df_r2_input["unique_text"]
-        .str.lower()
-        .apply(lambda t: hashlib.sha256(t.encode()).hexdigest())
-    )
+    # course_text/unique_id are derived inside resume_round_2
 
     # Reset progress bar for Round 2
     progress_bar.progress(0)
@@ -173,6 +160,7 @@ def handle_core_processing(caption, target_sector, target_sector_alias):
         ckpt,
         progress_bar,
         caption,
+        r1_valid=df_valid1,
     )
 
     st.success(f"Round 2 complete, all files saved in S3.")
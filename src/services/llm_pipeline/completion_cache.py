@@ -0,0 +1,72 @@
+# file: completion_cache.py
+import hashlib
+import json
+from threading import RLock
+
+from cachetools import LRUCache
+
+from services.storage import save_pickle, load_pickle
+
+
+def make_cache_key(messages) -> str:
+    """Content hash of a chat payload; identical prompts share a key."""
+    payload = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CompletionCache:
+    """
+    Thread-safe LRU of {prompt_hash: completion} shared by the r1/r2 workers,
+    so rows that produce an identical prompt only hit the API once. Keys cover
+    the whole prompt (KB, chart and all), never just the course and skill.
+    """
+
+    # Completions are also stored in the checkpoint results, so the cache only
+    # needs to be flushed to disk every so often rather than on every save.
+    PERSIST_EVERY = 100
+
+    def __init__(self, maxsize: int = 10000):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = RLock()
+        self._unsaved = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key, value):
+        # Empty completions are failures; never pin them in the cache
+        if not value:
+            return
+        with self._lock:
+            self._cache[key] = value
+            self._unsaved += 1
+
+    def clear(self) -> None:
+        """Forget every entry, e.g. when a session's data is wiped."""
+        with self._lock:
+            self._cache.clear()
+            self._unsaved = 0
+
+    def persist(self, path: str, force: bool = False) -> None:
+        """Write the cache to `path` (local or S3) once enough new entries accumulated."""
+        with self._lock:
+            if not self._unsaved or (not force and self._unsaved < self.PERSIST_EVERY):
+                return
+            snapshot = dict(self._cache.items())
+            self._unsaved = 0
+        save_pickle(snapshot, path)
+
+    def restore(self, path: str) -> None:
+        """Merge a previously persisted cache; a missing or unreadable file is ignored."""
+        try:
+            snapshot = load_pickle(path)
+        except Exception as e:
+            print(f"[Cache] No completion cache restored from {path}: {e}")
+            return
+        with self._lock:
+            for key, value in snapshot.items():
+                self._cache.setdefault(key, value)
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,92 @@
+# file: openai_client.py
+import os
+from functools import lru_cache
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+from dotenv import load_dotenv
+from config import LLM_MAX_WORKERS
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+try:
+    import streamlit as st
+
+    # Survives script reruns, so one client (and pool) serves the whole app
+    _cache_client = st.cache_resource(show_spinner=False)
+except ImportError:
+    _cache_client = lru_cache(maxsize=4)
+
+load_dotenv()
+
+OPENAI_BASE_URL = "https://litellm.govtext.gov.sg/"
+
+# Transient failures (429s, 5xx, dropped connections) are retried with
+# jittered exponential backoff; anything else surfaces on the first attempt.
+# The SDK's own retries are disabled so the two don't multiply.
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+)
+llm_retry = retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+
+
+@_cache_client
+def _build_openai_client(api_key, base_url):
+    """
+    Build one OpenAI client per (api_key, base_url) on top of a pooled HTTP/2
+    transport. The client is thread-safe, so the r1/r2 workers share it and
+    multiplex their requests over a handful of kept-alive connections.
+    """
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    return OpenAI(
+        api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0
+    )
+
+
+def get_openai_client():
+    """
+    Returns the shared OpenAI client instance.
+    Raises a ValueError if the API key is not found.
+    """
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        raise ValueError("API_KEY environment variable is not set.")
+
+    return _build_openai_client(api_key, OPENAI_BASE_URL)
+
+
+def default_max_workers():
+    """
+    Worker count for network-bound LLM calls: cpu_count() * 5, clamped to
+    LLM_MAX_WORKERS. The provider's rate limit, not the host, is the real
+    bound, so the ceiling should match the parallelism the provider allows.
+    """
+    return max(1, min(LLM_MAX_WORKERS, (os.cpu_count() or 1) * 5))
+
+
+@llm_retry
+def create_chat_completion(client, **kwargs):
+    """client.chat.completions.create with retries on transient errors."""
+    return client.chat.completions.create(**kwargs)
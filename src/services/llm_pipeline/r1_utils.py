@@ -1,66 +1,40 @@
 # file: r1_utils.py
-from openai import OpenAI
-from threading import Lock, local
+from openai import APIError, OpenAI
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor
-import json
+import orjson
 from datetime import datetime
 import os
 from models.prompt_templates import R1_SYSTEM_PROMPT
-
-from dotenv import load_dotenv
-
-load_dotenv()
+from services.llm_pipeline.openai_client import (
+    create_chat_completion,
+    default_max_workers,
+    get_openai_client,
+)
+from services.rate_limit import TokenBucket
+from config import LLM_REQUESTS_PER_MINUTE
+from services.llm_pipeline.completion_cache import completion_cache, make_cache_key
 
 timestamp = datetime.now().strftime("%Y%m%d_%H%M")
 
-# Thread-local storage for OpenAI client
-thread_local = local()
-
-
-def get_openai_client():
-    """
-    Returns a thread-local OpenAI client instance, creating one if it doesn't exist.
-    Raises a ValueError if the API key is not found.
-    """
-    if not hasattr(thread_local, "client"):
-        api_key = os.getenv("API_KEY")
-        if not api_key:
-            raise ValueError("API_KEY environment variable is not set.")
-        # Create a new client for this thread and store it in thread_local.
-        thread_local.client = OpenAI(
-            api_key=api_key, base_url="https://litellm.govtext.gov.sg/"
-        )
-    return thread_local.client
+# Shared by every process_row worker; only cache misses take a token
+request_bucket = TokenBucket.per_minute(LLM_REQUESTS_PER_MINUTE)
 
 
 def get_skill_info(skill_title: str, skill_df: pd.DataFrame) -> dict:
     """Function that filters for skill_title"""
     skill_info = skill_df[skill_df["TSC_CCS Title"] == skill_title]
     proficiency_dict = {}
-    levels = skill_info["Proficiency Level"].unique()
-
-    for level in levels:
-        level_info = skill_info[skill_info["Proficiency Level"] == level]
-        knowledge_items = (
-            level_info[level_info["Knowledge / Ability Classification"] == "knowledge"][
-                "Knowledge / Ability Items"
-            ]
-            .unique()
-            .tolist()
-        )
-        ability_items = (
-            level_info[level_info["Knowledge / Ability Classification"] == "ability"][
-                "Knowledge / Ability Items"
-            ]
-            .unique()
-            .tolist()
-        )
-        proficiency_description = level_info["Proficiency Description"].iloc[0]
+
+    # One pass per skill: group by level, then split items by classification
+    for level, level_info in skill_info.groupby("Proficiency Level", sort=False):
+        items = level_info.groupby("Knowledge / Ability Classification")[
+            "Knowledge / Ability Items"
+        ].unique()
         proficiency_dict[level] = {
-            "knowledge": knowledge_items,
-            "ability": ability_items,
-            "proficiency_description": proficiency_description,
+            "knowledge": list(items.get("knowledge", [])),
+            "ability": list(items.get("ability", [])),
+            "proficiency_description": level_info["Proficiency Description"].iloc[0],
         }
     return proficiency_dict
 
@@ -73,38 +47,37 @@ def format_for_openai(proficiency_info: dict, setup: int) -> str:
     2: Only use Proficiency Description + Ability Items
     3: Use Proficiency Description + Knowledge + Ability Items
     """
-    formatted_data = ""
+    out = []
     for level, items in proficiency_info.items():
-        formatted_data += f"Proficiency Level: {level}\n"
-        formatted_data += (
+        out.append(
+            f"Proficiency Level: {level}\n"
             f"Proficiency Description: {items['proficiency_description']}\n"
         )
         if setup == 1 or setup == 3:
-            formatted_data += "Knowledge Items:\n"
-            for item in items["knowledge"]:
-                formatted_data += f"- {item}\n"
+            out.append("Knowledge Items:\n")
+            out.extend(f"- {item}\n" for item in items["knowledge"])
         if setup == 2 or setup == 3:
-            formatted_data += "Ability Items:\n"
-            for item in items["ability"]:
-                formatted_data += f"- {item}\n"
-        formatted_data += "\n"
-    return formatted_data
+            out.append("Ability Items:\n")
+            out.extend(f"- {item}\n" for item in items["ability"])
+        out.append("\n")
+    return "".join(out)
 
 
 # Original get_proficiency_level function (commented out for testing)
 def get_proficiency_level(
     skill_title: str,
-    skill_info: dict,
+    formatted_data: str,
     course_description: str,
     course_learning: str,
     course_title: str,
-    setup: int,
     client: OpenAI,  # client is now a required argument
+    rpm=None,
 ) -> str:
     """
     Function to call OpenAI API.
+    `formatted_data` is the skill's format_for_openai output, built once per skill.
+    Cache misses wait on the optional `rpm` bucket before the call.
     """
-    formatted_data = format_for_openai(skill_info, setup)
     sys_messages = [
         {"role": "system", "content": R1_SYSTEM_PROMPT},
         {
@@ -117,8 +90,16 @@ def get_proficiency_level(
             ),
         },
     ]
+    cache_key = make_cache_key(sys_messages)
+    cached = completion_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if rpm is not None:
+        rpm.acquire()
     try:
-        response = client.chat.completions.create(
+        response = create_chat_completion(
+            client,
             model="gpt-4o-prd-gcc2-lb",
             messages=sys_messages,
             response_format={"type": "json_object"},
@@ -126,47 +107,61 @@ def get_proficiency_level(
             temperature=0.1,
         )
         completion_output = response.choices[0].message.content
-    except Exception as e:
-        # Added a more descriptive error message and return value
+    except APIError as e:
+        # Non-retryable errors, or transient ones that outlasted the retries
         print(f"[ERROR] OpenAI API call failed in get_proficiency_level: {e}")
         completion_output = ""
 
     if completion_output is None:
         return ""
+    completion_cache.set(cache_key, completion_output)
     return completion_output
 
 
-def process_row(row, skill_info_dict, knowledge_df, lock):
+# The only fields process_row reads from a row
+PROCESS_ROW_COLS = [
+    "Skill Title",
+    "Course Title",
+    "About This Course",
+    "What You'll Learn",
+    "Course Reference Number",
+]
+
+
+def process_row(row, skill_info_dict, knowledge_df):
     skill_title = row["Skill Title"]
     course_title = row["Course Title"]
     course_description = row["About This Course"]
     course_learning = row["What You'll Learn"]
 
-    # Get the thread-local client.
+    # Get the shared, connection-pooled client.
     thread_client = get_openai_client()
 
-    with lock:
-        if skill_title in skill_info_dict:
-            proficiency_info = skill_info_dict[skill_title]
-        else:
-            proficiency_info = get_skill_info(skill_title, knowledge_df)
-            skill_info_dict[skill_title] = proficiency_info
+    # skill_info_dict caches the formatted prompt block per skill; it only
+    # depends on the skill, not on the course. No lock: two workers may both
+    # build a missing block, but it is deterministic and setdefault keeps one
+    formatted_data = skill_info_dict.get(skill_title)
+    if formatted_data is None:
+        formatted_data = skill_info_dict.setdefault(
+            skill_title,
+            format_for_openai(get_skill_info(skill_title, knowledge_df), 3),
+        )
 
     proficiency_level_with_reason = get_proficiency_level(
         skill_title,
-        proficiency_info,
+        formatted_data,
         course_description,
         course_learning,
         course_title,
-        3,
         thread_client,
+        rpm=request_bucket,
     )
 
     try:
-        res_dict = json.loads(proficiency_level_with_reason)
+        res_dict = orjson.loads(proficiency_level_with_reason)
         res_dict["Skill Title"] = row["Skill Title"]
         res_dict["Course Reference Number"] = row["Course Reference Number"]
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(
             f"[ERROR] Failed to parse LLM response for {row['Course Reference Number']}: {e}"
         )
@@ -180,21 +175,24 @@ def process_row(row, skill_info_dict, knowledge_df, lock):
     return res_dict
 
 
-def run_in_parallel(course_df, knowledge_df):
+def run_in_parallel(course_df, knowledge_df, max_workers=None):
     """
     Executes the processing of each row in parallel using a ThreadPoolExecutor.
+    Results keep input order.
     """
-    skill_info_dict = {}
-    results = []
-    lock = Lock()
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [
-            executor.submit(
-                process_row, row, skill_info_dict, knowledge_df, lock
-            )  # client is no longer passed as an argument
-            for _, row in course_df.iterrows()
-        ]
-        for future in futures:
-            results.append(future.result())
+    if max_workers is None:
+        max_workers = default_max_workers()
+    # Format every skill's prompt block up front, once per skill
+    skill_info_dict = {
+        title: format_for_openai(get_skill_info(title, knowledge_df), 3)
+        for title in course_df["Skill Title"].unique()
+    }
+    rows = course_df[PROCESS_ROW_COLS].to_dict(orient="records")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                lambda row: process_row(row, skill_info_dict, knowledge_df), rows
+            )
+        )
     results_df = pd.DataFrame(results)
     return results_df
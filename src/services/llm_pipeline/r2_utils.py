@@ -1,54 +1,54 @@
 # file: r2_utils.py
 import hashlib
-from openai import OpenAI
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import queue
+import threading
+import time
 from tqdm import tqdm
-import json  # Ensure json is imported for loads()
+import orjson
+from openai import APIError
 from models.prompt_templates import R2_SYSTEM_PROMPT
-from dotenv import load_dotenv
-from threading import local
-
-load_dotenv()
+from services.llm_pipeline.openai_client import (
+    create_chat_completion,
+    default_max_workers,
+    get_openai_client,
+)
+from services.llm_pipeline.completion_cache import completion_cache, make_cache_key
 
 timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-thread_local = local()
 
 
 def generate_hash(text):
-    text = str(text).lower().strip()
-    string_hash = hashlib.sha256(str.encode(text)).hexdigest()
-    return string_hash
-
-
-def get_openai_client():
-    """
-    Creates and returns a thread-local OpenAI client instance.
-    Raises a ValueError if the API key is not found.
-    """
-    if not hasattr(thread_local, "client"):
-        api_key = os.getenv("API_KEY")
-        if not api_key:
-            raise ValueError("API_KEY environment variable is not set.")
-
-        # Create a new client for this thread and store it in thread_local.
-        thread_local.client = OpenAI(
-            api_key=api_key, base_url="https://litellm.govtext.gov.sg/"
-        )
-    return thread_local.client
+    # Only used as a join key, so a short non-cryptographic-strength digest is enough
+    return hashlib.blake2b(
+        str(text).lower().strip().encode(), digest_size=8
+    ).hexdigest()
 
 
 # The actual get_gpt_completion function (commented out for testing)
-def get_gpt_completion(sys_msg, model="gpt-4o-prd-gcc2-lb", temperature=0.1):
+def get_gpt_completion(sys_msg, model="gpt-4o-prd-gcc2-lb", temperature=0.1, rpm=None):
     """
     Calls the OpenAI API to get a completion.
+    Identical prompts are answered from the shared completion cache;
+    cache misses wait on the optional `rpm` bucket before the call.
     """
+    cache_key = make_cache_key(
+        {"model": model, "temperature": temperature, "messages": sys_msg}
+    )
+    cached = completion_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if rpm is not None:
+        rpm.acquire()
+
     try:
-        # Create a client instance for this specific API call/thread.
         client = get_openai_client()
 
-        response = client.chat.completions.create(
+        response = create_chat_completion(
+            client,
             model=model,
             messages=sys_msg,
             response_format={"type": "json_object"},
@@ -57,20 +57,21 @@ def get_gpt_completion(sys_msg, model="gpt-4o-prd-gcc2-lb", temperature=0.1):
         )
         content = response.choices[0].message.content
         if content:
-            completion_output = json.loads(content)
+            completion_output = orjson.loads(content)
         else:
             completion_output = {}
 
-    except ValueError as e:
-        # Catches the specific error from get_openai_client if API key is missing
-        print(f"[ERROR] Could not create OpenAI client: {e}")
+    except (orjson.JSONDecodeError, APIError) as e:
+        # API failures and malformed JSON; anything else is a bug and propagates
+        print(f"[ERROR] OpenAI API call failed in get_gpt_completion: {e}")
         completion_output = {}
 
-    except Exception as e:
-        # Catches other potential API or parsing errors
-        print(f"[ERROR] OpenAI API call failed in get_gpt_completion: {e}")
+    except ValueError as e:
+        # Catches the error from get_openai_client if API key is missing
+        print(f"[ERROR] Could not create OpenAI client: {e}")
         completion_output = {}
 
+    completion_cache.set(cache_key, completion_output)
     return completion_output
 
 
@@ -129,30 +130,101 @@ def get_gpt_completion(sys_msg, model="gpt-4o-prd-gcc2-lb", temperature=0.1):
 # ------------------------------------------------------------
 # 2) Build the two‐message chat payload
 # ------------------------------------------------------------
-def form_sys_msg(kb_dic, course_text, skill, skill_pl_reference_chart):
-    kb = kb_dic[skill.lower().strip()]
-    user_prompt = (
-        f"For the training course “{course_text}”, "
-        f"what is the most appropriate proficiency level to be tagged to the skill “{skill}”, "
-        f"based on the Knowledge Base {kb}? "
+def build_kb_snippets(kb_dic):
+    """Stringify each skill's Knowledge Base once, keyed by lowercased skill."""
+    return {skill: str(kb) for skill, kb in kb_dic.items()}
+
+
+def add_kb_snippets(df, kb_dic, skill_col="skill_lower"):
+    """
+    Return df with a `kb_snippet` column mapped from the skill column in one pass.
+    `skill_col` must already be normalised (see normalize_text).
+    """
+    snippets = build_kb_snippets(kb_dic)
+    return df.assign(kb_snippet=df[skill_col].map(snippets))
+
+
+def _direct_result(kb):
+    """
+    The answer for a skill whose Knowledge Base leaves nothing to decide, else
+    None: no entries at all → level 0, a single level → that level.
+    """
+    if not isinstance(kb, list) or not kb:
+        return {
+            "proficiency": 0,
+            "reason": "No Knowledge Base entries for this skill.",
+            "confidence": "low",
+        }
+    if len(kb) == 1:
+        return {
+            "proficiency": kb[0]["Proficiency Level"],
+            "reason": "Only one proficiency level is defined for this skill.",
+            "confidence": "high",
+        }
+    return None
+
+
+def direct_results(df, kb_dic, skill_col="skill_lower"):
+    """
+    Per-row result that needs no LLM call (see _direct_result), else None.
+    `skill_col` must already be normalised (see normalize_text).
+    """
+    kb = df[skill_col].map(kb_dic)
+    return kb.map(_direct_result).astype(object)
+
+
+def build_skill_context(kb_snippet, skill, skill_pl_reference_chart):
+    """
+    The part of the Round 2 user prompt that depends only on the skill (its
+    name, Knowledge Base and the reference chart), so it can be built once per
+    skill and shared by every course tagged with it.
+    """
+    return (
+        f"”, what is the most appropriate proficiency level to be tagged to the skill “{skill}”, "
+        f"based on the Knowledge Base {kb_snippet}? "
         f"Only if you need more info, refer to the Reference Document {skill_pl_reference_chart}. "
         "Reply in JSON as {'proficiency':<>, 'reason':<>, 'confidence':<high|medium|low>}."
     )
+
+
+def form_sys_msg_from_context(course_text, skill_context):
+    """form_sys_msg for a pre-built build_skill_context string."""
     return [
         {"role": "system", "content": R2_SYSTEM_PROMPT},
-        {"role": "user", "content": user_prompt},
+        {
+            "role": "user",
+            "content": f"For the training course “{course_text}{skill_context}",
+        },
     ]
 
 
+def form_sys_msg(kb_dic, course_text, skill, skill_pl_reference_chart):
+    """Two-message payload for one (course, skill) pair, looked up in kb_dic."""
+    kb = kb_dic[skill.lower().strip()]
+    return form_sys_msg_from_context(
+        course_text, build_skill_context(kb, skill, skill_pl_reference_chart)
+    )
+
+
 # ------------------------------------------------------------
 # 3) One row → one (id, result) tuple
 # ------------------------------------------------------------
-def get_pl_tagging(row, kb_dic, skill_pl_reference_chart):
-    sys_msg = form_sys_msg(
-        kb_dic=kb_dic,
-        course_text=row["course_text"],
-        skill=row["skill_lower"],
-        skill_pl_reference_chart=skill_pl_reference_chart,
+# Only these columns feed a prompt; rows travel as plain dicts of them
+ROW_FIELDS = ["unique_id", "kb_snippet", "course_text", "skill_lower"]
+
+
+def row_dicts(df):
+    """Rows of `df` as {field: value} dicts, without a Series per row."""
+    return df[ROW_FIELDS].to_dict(orient="records")
+
+
+def get_pl_tagging(row, skill_pl_reference_chart):
+    # Callers drop checkpointed rows before submitting, so every row here is new
+    sys_msg = form_sys_msg_from_context(
+        row["course_text"],
+        build_skill_context(
+            row["kb_snippet"], row["skill_lower"], skill_pl_reference_chart
+        ),
     )
     # The get_gpt_completion function handles its own client creation, which is correct.
     return row["unique_id"], get_gpt_completion(sys_msg=sys_msg)
@@ -161,8 +233,66 @@ def get_pl_tagging(row, kb_dic, skill_pl_reference_chart):
 # ------------------------------------------------------------
 # 4) Parallel execution, checkpointing, and result‐collection
 # ------------------------------------------------------------
+def _checkpoint_writer(
+    ckpt_q, checkpoint_filename, batch_size=256, flush_every=256, flush_secs=1.0
+):
+    """
+    Single consumer that appends finished rows as JSON lines. The file is
+    opened once with a 64 KiB buffer; queued lines are written in batches and
+    flushed every `flush_every` records or `flush_secs` seconds, whichever
+    comes first. A None sentinel drains, flushes and stops the writer.
+    """
+    with open(checkpoint_filename, "a", encoding="utf-8", buffering=1 << 16) as f:
+        unflushed, last_flush, done = 0, time.monotonic(), False
+        while not done:
+            try:
+                lines = [ckpt_q.get(timeout=flush_secs)]
+            except queue.Empty:
+                lines = []
+            # Drain whatever else is already queued, up to one batch
+            while lines and len(lines) < batch_size and not ckpt_q.empty():
+                lines.append(ckpt_q.get_nowait())
+            if None in lines:
+                done = True
+                lines = [line for line in lines if line is not None]
+            if lines:
+                f.write("\n".join(lines) + "\n")
+                unflushed += len(lines)
+            if unflushed and (
+                done
+                or unflushed >= flush_every
+                or time.monotonic() - last_flush >= flush_secs
+            ):
+                f.flush()
+                unflushed, last_flush = 0, time.monotonic()
+
+
+def _load_checkpoint(checkpoint_filename):
+    """Read back (id_list, result_list) from an existing checkpoint file."""
+    id_list, result_list = [], []
+    if not os.path.exists(checkpoint_filename):
+        return id_list, result_list
+    with open(checkpoint_filename, "rb") as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # A torn final line from an interrupted run
+                continue
+            id_list.append(record["unique_id"])
+            result_list.append(record["result"])
+    return id_list, result_list
+
+
 def get_result(df, max_workers, kb_dic, skill_pl_reference_chart, checkpoint_filename):
+    """
+    Tag every row of `df`, checkpointing finished ids to `checkpoint_filename`.
+    `df["skill_lower"]` must be normalised the same way as kb_dic's keys.
+    max_workers=None sizes the pool for network-bound work.
+    """
     n = len(df)
+    if not max_workers:
+        max_workers = default_max_workers()
     print(f"get_result called with {n} rows")
     if n == 0:
         print("Empty DataFrame – skipping executor entirely.")
@@ -170,24 +300,57 @@ def get_result(df, max_workers, kb_dic, skill_pl_reference_chart, checkpoint_fil
 
     os.makedirs(os.path.dirname(checkpoint_filename), exist_ok=True)
 
-    id_list, result_list = [], []
-    futures = {}
+    # Resolve each row's KB text and the reference chart text once, up front
+    df = add_kb_snippets(df, kb_dic)
+    skill_pl_reference_chart = str(skill_pl_reference_chart)
 
+    id_list, result_list = _load_checkpoint(checkpoint_filename)
+    id_set = set(id_list)
+
+    # All checkpoint I/O goes through one writer thread
+    ckpt_q = queue.Queue()
+    writer = threading.Thread(
+        target=_checkpoint_writer, args=(ckpt_q, checkpoint_filename), daemon=True
+    )
+    writer.start()
+
+    def record(returned_id, res):
+        id_set.add(returned_id)
+        id_list.append(returned_id)
+        result_list.append(res)
+        ckpt_q.put(orjson.dumps({"unique_id": returned_id, "result": res}).decode())
+
+    # Rows whose Knowledge Base has zero or one level are answered directly,
+    # without a prompt
+    direct = direct_results(df, kb_dic).tolist()
+    for uid, res in zip(df["unique_id"].tolist(), direct):
+        if uid not in id_set and res is not None:
+            record(uid, res)
+
+    # Skip checkpointed rows before submitting: they never reach the pool
+    todo = row_dicts(df[~df["unique_id"].isin(id_set)])
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         print("📝 Submitting tasks to ThreadPoolExecutor…")
-        for _, row in tqdm(df.iterrows(), total=n, desc="Submitting", unit="row"):
-            fut = executor.submit(get_pl_tagging, row, kb_dic, skill_pl_reference_chart)
-            futures[fut] = row["unique_id"]
+        futures = {
+            executor.submit(get_pl_tagging, row, skill_pl_reference_chart): row[
+                "unique_id"
+            ]
+            for row in todo
+        }
 
         print("🔄 Waiting for results…")
-        for fut in tqdm(as_completed(futures), total=n, desc="Processing", unit="task"):
+        for fut in tqdm(
+            as_completed(futures), total=len(futures), desc="Processing", unit="task"
+        ):
             uid = futures[fut]
             try:
                 returned_id, res = fut.result()
-                id_list.append(returned_id)
-                result_list.append(res)
+                record(returned_id, res)
             except Exception as e:
                 print(f"❌ Failed to process ID {uid}: {e}")
 
+    ckpt_q.put(None)
+    writer.join()
+
     print(f"\n🏁 Finished – {len(result_list)} / {n} rows succeeded.")
     return id_list, result_list
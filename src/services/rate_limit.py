@@ -0,0 +1,51 @@
+# services/rate_limit.py
+"""
+Token-bucket limiters used to pace calls to the LLM endpoint.
+"""
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `capacity` tokens, refilled continuously at
+    `rate_per_sec`. `acquire(n)` blocks only the calling thread, and sleeps
+    outside the lock so other workers can still take tokens that refill.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            # A little jitter so waiting workers don't all wake at once
+            time.sleep(wait + random.uniform(0, 0.1 * wait))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    @classmethod
+    def per_minute(cls, limit: float) -> "TokenBucket":
+        """A bucket allowing `limit` units per minute, with a minute's burst."""
+        return cls(rate_per_sec=limit / 60.0, capacity=limit)
@@ -3,6 +3,7 @@
 File management operations for both local filesystem and S3 storage.
 Handles listing files and directory cleanup.
 """
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 import logging
@@ -14,6 +15,29 @@ from botocore.exceptions import ClientError
 logger = logging.getLogger(__name__)
 
 
+def _iter_s3_objects(prefix):
+    """
+    Yield every object under `prefix`, requesting the next ListObjectsV2 page
+    in the background while the current page is being consumed.
+    """
+    s3 = get_s3_client()
+    kwargs = {"Bucket": S3_BUCKET_NAME, "Prefix": prefix}
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        page = s3.list_objects_v2(**kwargs)
+        while True:
+            next_page = None
+            if page.get("IsTruncated"):
+                next_page = prefetch.submit(
+                    s3.list_objects_v2,
+                    ContinuationToken=page["NextContinuationToken"],
+                    **kwargs,
+                )
+            yield from page.get("Contents", [])
+            if next_page is None:
+                return
+            page = next_page.result()
+
+
 def list_files(directory, pattern="*"):
     """
     List files in a directory (local or S3) matching a pattern.
@@ -38,8 +62,6 @@ def list_files(directory, pattern="*"):
                 # If path doesn't start with s3://, treat it as a prefix
                 prefix = str(directory).lstrip("/")
 
-            s3 = get_s3_client()
-            paginator = s3.get_paginator("list_objects_v2")
             file_list = []
 
             # Convert glob pattern to simple endswith check for S3
@@ -48,10 +70,9 @@ def list_files(directory, pattern="*"):
             else:
                 suffix = ""
 
-            for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
-                for obj in page.get("Contents", []):
-                    if not suffix or obj["Key"].endswith(suffix):
-                        file_list.append(f"s3://{S3_BUCKET_NAME}/{obj['Key']}")
+            for obj in _iter_s3_objects(prefix):
+                if not suffix or obj["Key"].endswith(suffix):
+                    file_list.append(f"s3://{S3_BUCKET_NAME}/{obj['Key']}")
             return file_list
 
         except ClientError as e:
@@ -90,15 +111,12 @@ def s3_list_files_by_filename_contains(directory, contains_string, file_ext=".pa
             # If path doesn't start with s3://, treat it as a prefix
             prefix = str(directory).lstrip("/")
 
-        s3 = get_s3_client()
-        paginator = s3.get_paginator("list_objects_v2")
         matches = []
-        for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
-            for obj in page.get("Contents", []):
-                key = obj["Key"]
-                filename = key.split("/")[-1]
-                if contains_string in filename and filename.endswith(file_ext):
-                    matches.append(f"s3://{S3_BUCKET_NAME}/{key}")
+        for obj in _iter_s3_objects(prefix):
+            key = obj["Key"]
+            filename = key.split("/")[-1]
+            if contains_string in filename and filename.endswith(file_ext):
+                matches.append(f"s3://{S3_BUCKET_NAME}/{key}")
         return matches
     except ClientError as e:
         raise Exception(f"Failed to list S3 objects in {directory}: {e}")
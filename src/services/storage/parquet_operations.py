@@ -10,7 +10,7 @@ from pathlib import Path
 import logging
 
 from config import USE_S3, S3_BUCKET_NAME
-from .s3_client import get_s3_client, parse_s3_path
+from .s3_client import get_s3_client, parse_s3_path, S3_TRANSFER_CONFIG
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger(__name__)
@@ -96,6 +96,7 @@ def save_parquet(df, path, compression="snappy"):
                     "ContentType": "application/octet-stream",
                     "ServerSideEncryption": "AES256",
                 },
+                Config=S3_TRANSFER_CONFIG,
             )
             logger.info(
                 f"✅ SAVE_PARQUET: S3 upload completed successfully to s3://{S3_BUCKET_NAME}/{key}"
@@ -14,6 +14,7 @@ from services.storage.s3_client import (
     parse_s3_path,
     validate_file_size,
     S3_BUCKET_NAME,
+    S3_TRANSFER_CONFIG,
 )
 from exceptions.storage_exceptions import S3Error, LocalStorageError, ValidationError
 from botocore.exceptions import ClientError, NoCredentialsError
@@ -66,10 +67,11 @@ def save_pickle(obj: Any, path: str, max_size_mb: int = 100) -> None:
     try:
         buf = io.BytesIO()
         pickle.dump(obj, buf, protocol=pickle.HIGHEST_PROTOCOL)
+        size = buf.tell()
         buf.seek(0)
 
         # Validate size
-        validate_file_size(len(buf.getvalue()), max_size_mb)
+        validate_file_size(size, max_size_mb)
 
     except Exception as e:
         raise ValidationError(f"Failed to serialize object: {e}")
@@ -83,16 +85,20 @@ def save_pickle(obj: Any, path: str, max_size_mb: int = 100) -> None:
                 # If path doesn't start with s3://, treat it as a key
                 key = str(path).lstrip("/")
 
-            get_s3_client().put_object(
-                Bucket=S3_BUCKET_NAME,
-                Key=key,
-                Body=buf.getvalue(),
-                ContentType="application/octet-stream",
-                ServerSideEncryption="AES256",
-                Metadata={
-                    "pickle-version": str(pickle.HIGHEST_PROTOCOL),
-                    "content-type": "pickle",
+            # Streams the buffer itself; large checkpoints go up as parallel parts
+            get_s3_client().upload_fileobj(
+                buf,
+                S3_BUCKET_NAME,
+                key,
+                ExtraArgs={
+                    "ContentType": "application/octet-stream",
+                    "ServerSideEncryption": "AES256",
+                    "Metadata": {
+                        "pickle-version": str(pickle.HIGHEST_PROTOCOL),
+                        "content-type": "pickle",
+                    },
                 },
+                Config=S3_TRANSFER_CONFIG,
             )
             logger.info(f"Successfully saved pickle to S3: s3://{S3_BUCKET_NAME}/{key}")
 
@@ -104,7 +110,7 @@ def save_pickle(obj: Any, path: str, max_size_mb: int = 100) -> None:
             file_path.parent.mkdir(parents=True, exist_ok=True)
 
             with open(file_path, "wb") as f:
-                f.write(buf.getvalue())
+                f.write(buf.getbuffer())
             logger.info(f"Successfully saved pickle locally: {path}")
 
         except Exception as e:
@@ -10,6 +10,7 @@ This module provides S3 client functionality for Kubernetes environments with:
 import os
 import logging
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from dotenv import load_dotenv
 from functools import lru_cache
@@ -23,6 +24,13 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Uploads above 8 MiB go up as 8 MiB parts on up to 8 threads
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+)
+
 
 def check_s3_permissions(s3_client, bucket_name):
     """
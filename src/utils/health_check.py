@@ -1,10 +1,10 @@
 # src/utils/health_check.py
-from openai import OpenAI
 import os
 import logging
 from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 from services.storage.s3_client import get_s3_client
+from services.llm_pipeline.openai_client import get_openai_client
 from config import S3_BUCKET_NAME
 from exceptions.storage_exceptions import S3Error
 
@@ -31,10 +31,8 @@ def check_openai_api_health():
             )
             return False
 
-        client = OpenAI(
-            api_key=api_key,
-            base_url="https://litellm.govtext.gov.sg/",
-        )
+        # Same pooled client as the pipeline, so a warm check also warms it
+        client = get_openai_client()
 
         response = client.chat.completions.create(
             model="gpt-4o-prd-gcc2-lb",
@@ -1,3 +1,8 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
 def wrap_valid_df_with_name(df, target_sector_alias):
     name = f"Valid Skills for {target_sector_alias} sector"
     return (df, name)
@@ -11,3 +16,99 @@ def wrap_invalid_df_with_name(df, target_sector_alias):
 def wrap_all_df_with_name(df, target_sector_alias):
     name = f"All Tagged Skills for {target_sector_alias} sector"
     return (df, name)
+
+
+def normalize_text(values):
+    """
+    Lowercase and strip whitespace with Python's str.lower()/str.strip(), so
+    skill keys match the SFw exactly as before on any Unicode input (Arrow's
+    utf8_lower/utf8_trim_whitespace differ on some code points). Returns an
+    object Series with nulls kept and other non-strings as NaN.
+    """
+    return values.astype(object).str.lower().str.strip()
+
+
+def to_shared_categories(frames, column):
+    """
+    Cast `column` in every frame (in place) to one common categorical dtype,
+    so merges and groupbys on it compare integer codes rather than strings.
+    """
+    values = pd.concat([df[column] for df in frames], ignore_index=True)
+    dtype = pd.CategoricalDtype(values.dropna().unique())
+    for df in frames:
+        df[column] = df[column].astype(dtype)
+
+
+def sfw_level_mask(df, sfw, level_col="proficiency_level"):
+    """
+    Boolean mask over `df`, True where its (skill_lower, `level_col`) pair is a
+    (skill, Proficiency Level) defined in `sfw`. One flat set of pairs and a
+    left merge, so no per-skill grouping or row-wise lookups.
+    """
+    pairs = (
+        sfw[["skill_lower", "Proficiency Level"]]
+        .drop_duplicates()
+        .rename(columns={"Proficiency Level": level_col})
+    )
+    return (
+        df.merge(pairs, on=["skill_lower", level_col], how="left", indicator=True)[
+            "_merge"
+        ]
+        .eq("both")
+        .to_numpy()
+    )
+
+
+def build_course_text(df):
+    """
+    "Course Title |: About This Course | What You'll Learn" per row, joined in
+    Arrow's C++ kernels rather than one Python str per `+`. A null in any part
+    gives a null, as the object-dtype concatenation did.
+    """
+
+    def arrow(col):
+        return pa.array(df[col].astype("string[pyarrow]").array)
+
+    def sep(text):
+        return pa.scalar(text, pa.large_string())
+
+    head = pc.binary_join_element_wise(
+        arrow("Course Title"), arrow("About This Course"), sep(" |: ")
+    )
+    text = pc.binary_join_element_wise(head, arrow("What You'll Learn"), sep(" | "))
+    return pd.Series(
+        pd.arrays.ArrowStringArray(text), index=df.index, name="course_text"
+    )
+
+
+def build_unique_ids(course_text, skill_title):
+    """
+    Deterministic uint64 id per row from course_text + Skill Title, lowercased
+    and stripped. course_text arrives as string[pyarrow], whose .str.lower()
+    is Arrow's utf8_lower; casting to object first keeps Python's str.lower
+    and str.strip, which differ on some non-ASCII text. A null course_text
+    counts as "", so such rows still get an id per skill rather than all
+    sharing the hash of a null.
+    """
+    text = course_text.astype(object).fillna("").str.cat(skill_title.astype(object))
+    text = text.str.lower().str.strip()
+    return pd.util.hash_pandas_object(text, index=False).astype("uint64")
+
+
+def coalesce_merge_suffixes(df, bases):
+    """
+    Fold the `<base>_x` / `<base>_y` columns left by a merge back into `<base>`,
+    preferring _y and falling back to _x. A lone _x or _y is just renamed.
+    Returns a new frame built with one rename, one drop and one assign.
+    """
+    renames, coalesced, to_drop = {}, {}, []
+    for base in bases:
+        x, y = f"{base}_x", f"{base}_y"
+        if x in df.columns and y in df.columns:
+            coalesced[base] = df[y].fillna(df[x])
+            to_drop += [x, y]
+        elif x in df.columns:
+            renames[x] = base
+        elif y in df.columns:
+            renames[y] = base
+    return df.drop(columns=to_drop).rename(columns=renames).assign(**coalesced)
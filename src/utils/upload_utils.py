@@ -1,3 +1,5 @@
+import io
+
 import pandas as pd
 import streamlit as st
 from pathlib import Path
@@ -27,6 +29,17 @@ async def process_file_upload(
     return await validator(uploaded)
 
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_uploaded_bytes(data: bytes, file_ext: str) -> pd.DataFrame:
+    """
+    Parse an uploaded file's bytes, cached on their content so Streamlit reruns
+    of the upload page don't re-run the (pure Python) openpyxl parser.
+    """
+    if file_ext in [".xlsx", ".xls"]:
+        return pd.read_excel(io.BytesIO(data))
+    return pd.read_csv(io.BytesIO(data))
+
+
 def read_uploaded_file(uploaded) -> Optional[pd.DataFrame]:
     """
     Read uploaded file into a pandas DataFrame.
@@ -41,17 +54,13 @@ def read_uploaded_file(uploaded) -> Optional[pd.DataFrame]:
     try:
         file_ext = Path(uploaded.name).suffix.lower()
 
-        if file_ext in [".xlsx", ".xls"]:
-            df = pd.read_excel(uploaded)
-        elif file_ext == ".csv":
-            df = pd.read_csv(uploaded)
-        else:
+        if file_ext not in [".xlsx", ".xls", ".csv"]:
             st.error(
                 f"Unsupported file format: {file_ext}. Please upload an Excel or CSV file."
             )
             return None
 
-        return df
+        return _parse_uploaded_bytes(uploaded.getvalue(), file_ext)
     except Exception as e:
         st.error(f"Error reading file {uploaded.name}: {e}")
         return None
@@ -1,7 +1,6 @@
 import pandas as pd
 from typing import Union, Optional
 import json
-from ast import literal_eval
 
 from config import COURSE_DESCR_COLS, S3_BUCKET_NAME
 from services.storage.s3_client import get_s3_client